@@ -3,13 +3,147 @@ import pandas as pd
 import hashlib
 import logging
 from sqlalchemy import create_engine, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from dotenv import load_dotenv
 import os
-from typing import Tuple, Dict, Any
+import threading
+from typing import Tuple, Dict, Any, Iterable, Iterator
 
 load_dotenv(override=True)
 logger = logging.getLogger(__name__)
 
+KEY_COLUMNS = [
+    'recognition_number',
+    'standards_developing_organization',
+    'standard_designation_number_and_date'
+]
+# Upper bound on rows per multi-row INSERT; the actual chunk is shrunk to fit
+# the server's max_allowed_packet (4MB by default on MySQL 5.7)
+INSERT_CHUNK_SIZE = 10000
+# Fraction of max_allowed_packet a single INSERT statement may use
+INSERT_PACKET_FRACTION = 0.5
+# Unprocessed standards fetched (and handed to the processor) per query
+UNPROCESSED_CHUNK_SIZE = 10000
+
+# One engine (and connection pool) per connection string, shared by every
+# FDADatabaseOperations instance in the process.
+_engine_cache = {}
+_engine_lock = threading.Lock()
+# Engines on which the uk_unique_id migration has been verified/applied.
+# Only successes are recorded, so a failed check is retried on the next insert.
+_unique_index_ready = set()
+_migration_lock = threading.Lock()
+# Colliding unique_ids logged when the UNIQUE key cannot be added
+DUPLICATE_ID_LOG_LIMIT = 50
+
+# ---------------------- SQL STATEMENTS ----------------------
+# Built once at import so every call reuses the same TextClause (and its
+# cached compiled form) instead of re-parsing the SQL.
+# A unique index on unique_id alone; a composite one would not dedupe on it.
+UNIQUE_INDEX_EXISTS_SQL = text("""
+    SELECT index_name FROM information_schema.statistics
+    WHERE table_schema = DATABASE()
+      AND table_name = 'fda_standards'
+      AND non_unique = 0
+    GROUP BY index_name
+    HAVING COUNT(*) = 1 AND MAX(column_name) = 'unique_id'
+    LIMIT 1
+""")
+
+ADD_UNIQUE_INDEX_SQL = text("""
+    ALTER TABLE fda_standards
+    ADD UNIQUE KEY uk_unique_id (unique_id)
+""")
+
+DUPLICATE_IDS_SQL = text("""
+    SELECT unique_id, COUNT(*) AS n
+    FROM fda_standards
+    GROUP BY unique_id
+    HAVING COUNT(*) > 1
+    LIMIT :limit
+""")
+
+UPDATE_S3_PATHS_SQL = text("""
+    UPDATE fda_standards
+    SET aws_key = :pdf_key,
+        aws_html_key = :html_key
+    WHERE title_link = :url
+""")
+
+UNPROCESSED_STANDARDS_SQL = text("""
+    SELECT recognition_number, standard_title, title_link, unique_id, date_of_entry
+    FROM fda_standards
+    WHERE ((aws_key IS NULL OR aws_key = '')
+        OR (aws_html_key IS NULL OR aws_html_key = ''))
+      AND unique_id > :after
+    ORDER BY unique_id
+    LIMIT :limit
+""")
+
+# Rows the unique_id keyset above can never reach; fetched as one final chunk.
+UNPROCESSED_WITHOUT_ID_SQL = text("""
+    SELECT recognition_number, standard_title, title_link, unique_id, date_of_entry
+    FROM fda_standards
+    WHERE ((aws_key IS NULL OR aws_key = '')
+        OR (aws_html_key IS NULL OR aws_html_key = ''))
+      AND (unique_id IS NULL OR unique_id = '')
+""")
+
+SYNC_STATUS_SQL = text("""
+    SELECT COUNT(*) AS total,
+           SUM(CASE WHEN aws_key IS NOT NULL AND aws_key != ''
+                     AND aws_html_key IS NOT NULL AND aws_html_key != ''
+                    THEN 1 ELSE 0 END) AS processed
+    FROM fda_standards
+""")
+
+MAX_ALLOWED_PACKET_SQL = text("""
+    SELECT @@max_allowed_packet
+""")
+
+COUNT_STANDARDS_SQL = text("""
+    SELECT COUNT(*) FROM fda_standards
+""")
+
+RESET_S3_PATHS_SQL = text("""
+    UPDATE fda_standards
+    SET aws_key = NULL, aws_html_key = NULL
+""")
+
+
+def _insert_skip_duplicates(table, conn, keys, data_iter):
+    """pandas to_sql method issuing a multi-row INSERT ... ON DUPLICATE KEY UPDATE no-op.
+
+    Unlike INSERT IGNORE, only duplicate keys are skipped; truncation and
+    other data errors still raise.
+    """
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    sql_table = table.table
+    stmt = mysql_insert(sql_table).values(rows)
+    result = conn.execute(stmt.on_duplicate_key_update(unique_id=sql_table.c.unique_id))
+    return result.rowcount
+
+
+def _insert_chunk_size(conn, df: pd.DataFrame) -> int:
+    """Rows per INSERT that keep one statement within the server's max_allowed_packet.
+
+    Row size is estimated from pandas' deep memory usage, which overstates the
+    SQL literal size, so the estimate errs on the small side.
+    """
+    packet = int(conn.execute(MAX_ALLOWED_PACKET_SQL).scalar())
+    row_bytes = max(1, int(df.memory_usage(index=False, deep=True).sum() / max(len(df), 1)))
+    return max(1, min(INSERT_CHUNK_SIZE, int(packet * INSERT_PACKET_FRACTION) // row_bytes))
+
+
+def _column_or_default(df: pd.DataFrame, col: str, default):
+    """Return df[col] with NaNs filled, or the scalar default if the column is missing."""
+    if col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype) and default not in series.cat.categories:
+            series = series.cat.add_categories([default])
+        return series.fillna(default)
+    return default
+
 
 class FDADatabaseOperations:
     def __init__(self):
@@ -20,20 +154,68 @@ class FDADatabaseOperations:
         logger.info(f"Database initialized: {self.db_name}")
 
     def _create_engine(self):
-        """Create SQLAlchemy engine."""
+        """Return the shared SQLAlchemy engine, creating it on first use."""
         db_host = os.getenv("DB_HOST")
         db_port = os.getenv("DB_PORT", "3306")
         db_user = os.getenv("DB_USER")
         db_password = os.getenv("DB_PASS")
         conn_str = f'mysql+pymysql://{db_user}:{db_password}@{db_host}:{db_port}/{self.db_name}'
-        return create_engine(conn_str, pool_pre_ping=True, pool_recycle=3600)
+        with _engine_lock:
+            engine = _engine_cache.get(conn_str)
+            if engine is None:
+                engine = create_engine(
+                    conn_str,
+                    echo=False,
+                    pool_size=10,
+                    max_overflow=20,
+                    pool_use_lifo=True,
+                    pool_pre_ping=True,
+                    pool_recycle=3600,
+                    isolation_level='READ COMMITTED',
+                    connect_args={'connect_timeout': 5, 'charset': 'utf8mb4'}
+                )
+                _engine_cache[conn_str] = engine
+            return engine
+
+    def ensure_unique_index(self) -> bool:
+        """Migration: make sure fda_standards has a UNIQUE key on unique_id.
+
+        Called lazily before inserting; once it succeeds for an engine it is
+        not checked again.
+        """
+        with _migration_lock:
+            if self.engine in _unique_index_ready:
+                return True
+
+            try:
+                with self.engine.begin() as conn:
+                    existing = conn.execute(UNIQUE_INDEX_EXISTS_SQL).first()
+                    if existing is None:
+                        try:
+                            conn.execute(ADD_UNIQUE_INDEX_SQL)
+                        except Exception:
+                            self._log_duplicate_ids()
+                            raise
+                        logger.info("Added UNIQUE key uk_unique_id on fda_standards.unique_id")
+
+            except Exception as e:
+                logger.error(f"Error ensuring unique index on unique_id: {str(e)}")
+                return False
+
+            _unique_index_ready.add(self.engine)
+            return True
 
-    def generate_unique_id(self, recognition_number: str,
-                           standards_developing_organization: str,
-                           standard_designation_number_and_date: str) -> str:
-        """Generate MD5 hash as unique_id."""
-        combined = f"{recognition_number}|{standards_developing_organization}|{standard_designation_number_and_date}"
-        return hashlib.md5(combined.encode()).hexdigest()
+    def _log_duplicate_ids(self):
+        """Log unique_ids that occur more than once and block the UNIQUE key."""
+        try:
+            with self.engine.connect() as conn:
+                rows = conn.execute(DUPLICATE_IDS_SQL, {'limit': DUPLICATE_ID_LOG_LIMIT}).all()
+        except Exception as e:
+            logger.error(f"Error listing duplicate unique_ids: {str(e)}")
+            return
+
+        for unique_id, count in rows:
+            logger.error(f"Duplicate unique_id blocks uk_unique_id: {unique_id!r} appears {count} times")
 
     def log_duplicates(self, df: pd.DataFrame):
         """Log duplicate standard_title entries."""
@@ -42,102 +224,83 @@ class FDADatabaseOperations:
                 logger.warning("No standard_title column in DataFrame")
                 return
 
-            duplicates = df[df.duplicated(subset=['standard_title'], keep=False)]
-            if not duplicates.empty:
-                duplicate_titles = duplicates['standard_title'].value_counts()
+            counts = df['standard_title'].value_counts(sort=False)
+            duplicate_titles = counts[counts > 1]
+            if not duplicate_titles.empty:
                 for title, count in duplicate_titles.items():
-                    if count > 1:
-                        logger.warning(f"Duplicate standard_title found: '{title}' appears {count} times")
+                    logger.warning(f"Duplicate standard_title found: '{title}' appears {count} times")
             else:
                 logger.info("No duplicate standard_titles found")
         except Exception as e:
             logger.error(f"Error checking for duplicate standard_titles: {str(e)}")
 
-    def check_duplicates(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Check for duplicates and return only new records."""
-        try:
-            if df.empty:
-                logger.warning("Empty DataFrame provided")
-                return pd.DataFrame()
-
-            required_cols = [
-                'recognition_number',
-                'standards_developing_organization',
-                'standard_designation_number_and_date'
-            ]
-            missing_cols = [col for col in required_cols if col not in df.columns]
-            if missing_cols:
-                logger.error(f"Missing columns: {missing_cols}")
-                return pd.DataFrame()
-
-            with self.engine.connect() as conn:
-                existing_result = conn.execute(text("""
-                    SELECT unique_id FROM fda_standards
-                    WHERE unique_id IS NOT NULL
-                """))
-                existing_ids = {row[0] for row in existing_result.fetchall()}
-
-            df = df.copy()
-            df['unique_id'] = df.apply(
-                lambda row: self.generate_unique_id(
-                    str(row['recognition_number']),
-                    str(row['standards_developing_organization']),
-                    str(row['standard_designation_number_and_date'])
-                ), axis=1
-            )
-
-            new_records = df[~df['unique_id'].isin(existing_ids)]
-            logger.info(f"Total: {len(df)}, Existing: {len(existing_ids)}, New: {len(new_records)}")
-            return new_records
+    def _assign_unique_ids(self, df: pd.DataFrame, **columns) -> pd.DataFrame:
+        """Return a copy of df with the MD5 unique_id column (and any extra columns) added."""
+        if df.empty:
+            logger.warning("Empty DataFrame provided")
+            return pd.DataFrame()
 
-        except Exception as e:
-            logger.error(f"Error checking duplicates: {str(e)}")
+        missing_cols = [col for col in KEY_COLUMNS if col not in df.columns]
+        if missing_cols:
+            logger.error(f"Missing columns: {missing_cols}")
             return pd.DataFrame()
 
-    def insert_new_standards(self, df: pd.DataFrame) -> Tuple[bool, str]:
-        """Insert new standards with unique_id."""
-        try:
-            new_df = self.check_duplicates(df)
-            if new_df.empty:
-                return True, "No new records to insert"
+        key_values = (df[col].astype(str).tolist() for col in KEY_COLUMNS)
+        unique_ids = [
+            hashlib.md5(f"{rec}|{sdo}|{designation}".encode()).hexdigest()
+            for rec, sdo, designation in zip(*key_values)
+        ]
+        return df.assign(unique_id=unique_ids, **columns)
 
-            new_df = new_df.copy()
-            new_df['aws_bucket'] = self.s3_bucket
-            new_df['aws_key'] = None
-            new_df['aws_html_key'] = None
+    def insert_new_standards(self, df: pd.DataFrame) -> Tuple[bool, str]:
+        """Insert new standards with unique_id.
 
-            if 'date_of_entry' in new_df.columns:
-                new_df['date_of_entry'] = pd.to_datetime(
-                    new_df['date_of_entry'], format='%m/%d/%Y', errors='coerce'
-                ).dt.strftime('%Y-%m-%d')
+        Duplicates are skipped by the UNIQUE key on unique_id via a no-op
+        ON DUPLICATE KEY UPDATE, so existing ids never leave the database.
+        """
+        try:
+            if not self.ensure_unique_index():
+                logger.error("UNIQUE key on fda_standards.unique_id is missing, refusing to insert")
+                return False, "Insert failed: UNIQUE key on unique_id is missing"
 
-            defaults = {
-                'standard_title': '',
-                'specialty_task_group_area': 'UNKNOWN',
+            columns = {
+                'aws_bucket': self.s3_bucket,
                 'aws_key': None,
                 'aws_html_key': None,
+                'standard_title': _column_or_default(df, 'standard_title', ''),
+                'specialty_task_group_area': _column_or_default(df, 'specialty_task_group_area', 'UNKNOWN'),
             }
+            if 'date_of_entry' in df.columns:
+                columns['date_of_entry'] = pd.to_datetime(
+                    df['date_of_entry'], format='%m/%d/%Y', errors='coerce', cache=True
+                ).dt.date
+
+            new_df = self._assign_unique_ids(df, **columns)
+            if new_df.empty:
+                return True, "No new records to insert"
+
+            # FOUND_ROWS makes the upsert rowcount include skipped duplicates,
+            # so count inserts from the table size. Under READ COMMITTED the
+            # difference also includes rows committed meanwhile by other
+            # writers, so it is only approximate.
+            with self.engine.begin() as conn:
+                before = conn.execute(COUNT_STANDARDS_SQL).scalar()
+                chunksize = _insert_chunk_size(conn, new_df)
+                new_df.to_sql(
+                    name='fda_standards',
+                    con=conn,
+                    if_exists='append',
+                    index=False,
+                    chunksize=chunksize,
+                    method=_insert_skip_duplicates
+                )
+                inserted = max(0, conn.execute(COUNT_STANDARDS_SQL).scalar() - before)
+
+            if inserted == 0:
+                return True, "No new records to insert"
 
-            for col, default in defaults.items():
-                if col not in new_df.columns:
-                    new_df[col] = default
-                else:
-                    if default is None:
-                        new_df[col] = new_df[col].where(pd.notna(new_df[col]), None)
-                    else:
-                        new_df[col] = new_df[col].fillna(default)
-
-            new_df.to_sql(
-                name='fda_standards',
-                con=self.engine,
-                if_exists='append',
-                index=False,
-                chunksize=500,
-                method='multi'
-            )
-
-            logger.info(f"Inserted {len(new_df)} new records")
-            return True, f"Inserted {len(new_df)} records"
+            logger.info(f"Total: {len(new_df)}, Inserted ~{inserted} new records (from table row count)")
+            return True, f"Inserted ~{inserted} records (approximate; from table row count)"
 
         except Exception as e:
             logger.error(f"Error inserting standards: {str(e)}")
@@ -147,12 +310,7 @@ class FDADatabaseOperations:
         """Update database with S3 paths for PDF and HTML."""
         try:
             with self.engine.begin() as conn:
-                result = conn.execute(text("""
-                    UPDATE fda_standards
-                    SET aws_key = :pdf_key,
-                        aws_html_key = :html_key
-                    WHERE title_link = :url
-                """), {
+                result = conn.execute(UPDATE_S3_PATHS_SQL, {
                     'pdf_key': f"{self.s3_prefix}PDF/{pdf_filename}",
                     'html_key': f"{self.s3_prefix}HTML/{html_filename}",
                     'url': title_link
@@ -169,29 +327,85 @@ class FDADatabaseOperations:
             logger.error(f"Error updating S3 paths: {str(e)}")
             return False
 
-    def get_unprocessed_standards(self) -> pd.DataFrame:
-        """Get standards without PDF or HTML in S3."""
+    def update_s3_paths_bulk(self, records: Iterable[Tuple[str, str, str]]) -> bool:
+        """Update S3 paths for many (title_link, pdf_filename, html_filename) records in one transaction."""
+        params = [
+            {
+                'pdf_key': f"{self.s3_prefix}PDF/{pdf_filename}",
+                'html_key': f"{self.s3_prefix}HTML/{html_filename}",
+                'url': title_link
+            }
+            for title_link, pdf_filename, html_filename in records
+        ]
+        if not params:
+            return True
+
+        try:
+            with self.engine.begin() as conn:
+                result = conn.execute(UPDATE_S3_PATHS_SQL, params)
+
+            logger.info(f"Updated S3 paths for {result.rowcount} records ({len(params)} submitted)")
+            return True
+
+        except Exception as e:
+            logger.error(f"Error bulk updating S3 paths: {str(e)}")
+            return False
+
+    def iter_unprocessed_standards(self, chunksize: int = UNPROCESSED_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+        """Yield standards without PDF or HTML in S3, chunksize rows at a time.
+
+        Chunks are paged by unique_id (keyset on uk_unique_id), so no cursor is
+        held open while the caller works on a chunk. Rows with a NULL or empty
+        unique_id follow as one final chunk.
+        """
+        after = ''
+        while True:
+            df = self._read_unprocessed(UNPROCESSED_STANDARDS_SQL, {'after': after, 'limit': chunksize})
+            if df is None:
+                return
+            if df.empty:
+                break
+
+            after = df['unique_id'].iloc[-1]
+            yield self._with_filenames(df)
+
+            if len(df) < chunksize:
+                break
+
+        df = self._read_unprocessed(UNPROCESSED_WITHOUT_ID_SQL, {})
+        if df is not None and not df.empty:
+            yield self._with_filenames(df)
+
+    def _read_unprocessed(self, query, params) -> pd.DataFrame:
+        """Run one unprocessed-standards query; None on error."""
         try:
-            query = """
-                SELECT recognition_number, standard_title, title_link, unique_id
-                FROM fda_standards
-                WHERE (aws_key IS NULL OR aws_key = '')
-                OR (aws_html_key IS NULL OR aws_html_key = '')
-            """
             with self.engine.connect() as conn:
-                df = pd.read_sql_query(text(query), conn)
+                return pd.read_sql_query(query, conn, params=params)
+        except Exception as e:
+            logger.error(f"Error getting unprocessed standards: {str(e)}")
+            return None
+
+    @staticmethod
+    def _with_filenames(df: pd.DataFrame) -> pd.DataFrame:
+        """Add the pdf_filename/html_filename columns derived from number and title."""
+        tokens = (
+            df['standard_title'].fillna('').str.split().str[:3]
+            .str.join('_').str.replace(r'[\\/]', '_', regex=True)
+        )
+        stem = df['recognition_number'].astype(str) + '_' + tokens
+        df['pdf_filename'] = stem + '.pdf'
+        df['html_filename'] = stem + '.html'
+        return df
 
-            if not df.empty:
-                df['pdf_filename'] = df.apply(
-                    lambda row: f"{row['recognition_number']}_{'_'.join(row['standard_title'].split()[:3]).replace('/', '_').replace('\\', '_')}.pdf",
-                    axis=1
-                )
-                df['html_filename'] = df.apply(
-                    lambda row: f"{row['recognition_number']}_{'_'.join(row['standard_title'].split()[:3]).replace('/', '_').replace('\\', '_')}.html",
-                    axis=1
-                )
-                logger.info(f"Found {len(df)} unprocessed standards")
+    def get_unprocessed_standards(self) -> pd.DataFrame:
+        """Get standards without PDF or HTML in S3."""
+        try:
+            chunks = list(self.iter_unprocessed_standards())
+            if not chunks:
+                return pd.DataFrame()
 
+            df = pd.concat(chunks, ignore_index=True)
+            logger.info(f"Found {len(df)} unprocessed standards")
             return df
 
         except Exception as e:
@@ -202,12 +416,9 @@ class FDADatabaseOperations:
         """Get synchronization status."""
         try:
             with self.engine.connect() as conn:
-                db_total = conn.execute(text("SELECT COUNT(*) FROM fda_standards")).scalar() or 0
-                db_processed = conn.execute(text("""
-                    SELECT COUNT(*) FROM fda_standards
-                    WHERE aws_key IS NOT NULL AND aws_key != ''
-                      AND aws_html_key IS NOT NULL AND aws_html_key != ''
-                """)).scalar() or 0
+                row = conn.execute(SYNC_STATUS_SQL).one()
+                db_total = int(row.total or 0)
+                db_processed = int(row.processed or 0)
 
                 return {
                     'db_total': db_total,
@@ -223,10 +434,7 @@ class FDADatabaseOperations:
         """Reset AWS paths."""
         try:
             with self.engine.begin() as conn:
-                result = conn.execute(text("""
-                    UPDATE fda_standards
-                    SET aws_key = NULL, aws_html_key = NULL
-                """))
+                result = conn.execute(RESET_S3_PATHS_SQL)
                 logger.info(f"Reset S3 paths for {result.rowcount} records")
                 return True
 
@@ -234,15 +442,9 @@ class FDADatabaseOperations:
             logger.error(f"Error resetting S3 paths: {str(e)}")
             return False
 
-    def __del__(self):
-        """Cleanup DB engine."""
-        if hasattr(self, 'engine') and self.engine:
-            self.engine.dispose()
-
 
 def process_fda_standards(df: pd.DataFrame) -> Dict[str, Any]:
     """Process FDA standards data with deduplication."""
-    db_ops = None
     try:
         db_ops = FDADatabaseOperations()
         status = db_ops.get_sync_status()
@@ -254,25 +456,20 @@ def process_fda_standards(df: pd.DataFrame) -> Dict[str, Any]:
         if not success:
             return {"success": False, "message": message}
 
-        unprocessed = db_ops.get_unprocessed_standards()
+        pending = db_ops.get_sync_status()['pending']
 
         return {
             "success": True,
             "message": message,
             "new_records": len(df) if success else 0,
-            "pending_pdfs": len(unprocessed),
-            "sync_status": status,
-            "unprocessed_df": unprocessed
+            "pending_pdfs": pending,
+            "sync_status": status
         }
 
     except Exception as e:
         logger.error(f"Error processing standards: {str(e)}")
         return {"success": False, "message": str(e)}
 
-    finally:
-        if db_ops and hasattr(db_ops, 'engine'):
-            db_ops.engine.dispose()
-
 
 
 
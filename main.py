@@ -7,21 +7,28 @@ from fda_db_operations import FDADatabaseOperations, process_fda_standards
 from pdf_html_generator import FDAStandardsProcessor
 from config import setup_directories, DEFAULT_DOWNLOAD_DIR
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('pipeline.log', mode='a', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-logging.getLogger('urllib3').setLevel(logging.WARNING)
-logging.getLogger('requests').setLevel(logging.WARNING)
-logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
-logging.getLogger('botocore').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Per-standard fetch/render/upload is I/O bound; keep this within the DB engine's
+# pool_size + max_overflow so workers never wait on a connection.
+PIPELINE_WORKERS = 16
+
+def configure_logging():
+    """Configure logging; called from main() so spawned render workers that
+    re-import this module don't each open pipeline.log."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('pipeline.log', mode='a', encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    logging.getLogger('requests').setLevel(logging.WARNING)
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+    logging.getLogger('botocore').setLevel(logging.WARNING)
+
 def run_full_pipeline(processor: FDAStandardsProcessor, db_ops: FDADatabaseOperations):
     """Run the FDA standards pipeline."""
     try:
@@ -49,12 +56,13 @@ def run_full_pipeline(processor: FDAStandardsProcessor, db_ops: FDADatabaseOpera
             return True
         
         logger.info("Step 3: Processing unprocessed standards")
-        unprocessed_df = db_ops.get_unprocessed_standards()
-        
-        if not unprocessed_df.empty:
+        found_unprocessed = False
+        for unprocessed_df in db_ops.iter_unprocessed_standards():
+            found_unprocessed = True
             logger.info(f"Processing {len(unprocessed_df)} unprocessed standards")
             processor.process_unprocessed_standards(unprocessed_df)
-        else:
+
+        if not found_unprocessed:
             logger.info("No unprocessed standards found")
         
         final_status = db_ops.get_sync_status()
@@ -68,7 +76,7 @@ def run_full_pipeline(processor: FDAStandardsProcessor, db_ops: FDADatabaseOpera
 
 def main():
     """Main pipeline execution."""
-    db_ops = None
+    configure_logging()
     try:
         pdf_path, html_path = setup_directories(DEFAULT_DOWNLOAD_DIR)
         logger.info(f"Using PDF directory: {pdf_path}, HTML directory: {html_path}")
@@ -84,9 +92,8 @@ def main():
             logger.info("FORCE_DB_LOAD enabled, resetting S3 paths")
             db_ops.reset_s3_paths()
         
-        processor = FDAStandardsProcessor(pdf_path, html_path, use_s3=True)
-        
-        success = run_full_pipeline(processor, db_ops)
+        with FDAStandardsProcessor(pdf_path, html_path, use_s3=True, max_workers=PIPELINE_WORKERS) as processor:
+            success = run_full_pipeline(processor, db_ops)
         
         if success:
             logger.info("Pipeline completed successfully")
@@ -98,9 +105,6 @@ def main():
     except Exception as e:
         logger.error(f"Critical error: {str(e)}", exc_info=True)
         return 1
-    finally:
-        if db_ops and hasattr(db_ops, 'engine'):
-            db_ops.engine.dispose()
 
 if __name__ == "__main__":
     exit_code = main()
@@ -1,19 +1,150 @@
+import functools
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from requests.utils import get_encoding_from_headers
+from urllib3.util.retry import Retry
+from lxml import etree, html as lh
 import pandas as pd
 from fpdf import FPDF
 import os
 import logging
-import time
 import re
+import threading
 import unicodedata
+from dataclasses import dataclass
+from typing import Optional
 from s3_operations import S3Operations
 from config import HEADERS, validate_s3_config
 from fda_db_operations import FDADatabaseOperations
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import multiprocessing
 
 logger = logging.getLogger(__name__)
 
+# Patterns are compiled once here rather than on every row / page.
+DATE_LABELS = ["Date of Entry", "Publication Date", "Posted Date", "Effective Date"]
+_FILENAME_RE = re.compile(r'[<>:"/\\|?*\r\n]')
+# One alternation for all date labels; group N+1 matched means DATE_LABELS[N].
+_DATE_LABELS_RE = re.compile('|'.join(f'({re.escape(label)})' for label in DATE_LABELS), re.IGNORECASE)
+_DATE_RE = re.compile(r'\b(\d{1,2}[-/]\d{1,2}[-/]\d{4})\b')
+
+# XPaths for extract_detailed_data, compiled once.
+_XP_TEXT = etree.XPath('//text()')
+_XP_ANCESTOR_TD = etree.XPath('ancestor-or-self::td[1]')
+_XP_ANCESTOR_SPAN = etree.XPath('ancestor-or-self::span[1]')
+_XP_NEXT_TD = etree.XPath('following-sibling::td[1]')
+_XP_NEXT_TABLE = etree.XPath('(descendant::table | following::table)[1]')
+
+
+def _first(results):
+    return results[0] if results else None
+
+
+def _text_parent(text):
+    """Element containing a text node (lxml attaches tail text to the previous sibling)."""
+    parent = text.getparent()
+    return parent.getparent() if text.is_tail and parent is not None else parent
+
+
+@functools.lru_cache(maxsize=4096)
+def _sanitize_str(text: str) -> str:
+    """NFKD + latin-1 round-trip; cached since labels and SDO names repeat on every row."""
+    text = unicodedata.normalize("NFKD", text)
+    return text.encode("latin-1", "replace").decode("latin-1")
+
+
+def _sanitize_text(text) -> str:
+    if text is None:
+        return "N/A"
+    return _sanitize_str(text if isinstance(text, str) else str(text))
+
+
+def _stripped_text(el, sep: str = '') -> str:
+    """Equivalent of BeautifulSoup's get_text(sep, strip=True)."""
+    return sep.join(s.strip() for s in el.itertext() if s.strip())
+
+# Columns process_standard reads; rows are dispatched as namedtuples of these.
+DISPATCH_COLUMNS = ['title_link', 'pdf_filename', 'html_filename', 'pdf_s3_key', 'html_s3_key',
+                    'date_of_entry', 'recognition_number']
+
+# ---------------------- EXTRACTED RECORD ----------------------
+@dataclass(slots=True)
+class StandardRec:
+    """Fields extracted from a standard's detail page."""
+    date_of_entry: str = "N/A"
+    fr_recognition_number: Optional[str] = None
+    standard: Optional[str] = None
+    scope_abstract: Optional[str] = None
+    extent_of_recognition: Optional[str] = None
+    sdo_acronym: Optional[str] = None
+    sdo_name: Optional[str] = None
+    sdo_website: Optional[str] = None
+
+    def main_fields(self):
+        """(label, value) pairs in output order; labels are what the PDF/HTML show."""
+        return (("FR_Recognition_Number", self.fr_recognition_number),
+                ("Date_of_Entry", self.date_of_entry),
+                ("Standard", self.standard),
+                ("Scope_Abstract", self.scope_abstract),
+                ("Extent_of_Recognition", self.extent_of_recognition))
+
+    def sdo_fields(self):
+        return (("Acronym", self.sdo_acronym),
+                ("Name", self.sdo_name),
+                ("Website", self.sdo_website))
+
+# ---------------------- LABEL HANDLERS ----------------------
+# extract_detailed_data walks the page's text nodes once; a node equal to one of
+# these labels is handed to its handler, which returns True once the field is set.
+def _label_owner(text, xp_ancestor):
+    """Nearest enclosing td/span of a label text node, if that element's whole text is the label."""
+    parent = _text_parent(text)
+    owner = _first(xp_ancestor(parent)) if parent is not None else None
+    return owner if owner is not None and owner.text_content() == text else None
+
+
+def _handle_sibling_td(text, rec: StandardRec) -> bool:
+    parent = _text_parent(text)
+    td = _first(_XP_ANCESTOR_TD(parent)) if parent is not None else None
+    sibling = _first(_XP_NEXT_TD(td)) if td is not None else None
+    rec.fr_recognition_number = sibling.text_content().strip() if sibling is not None else None
+    return True
+
+
+def _next_table_handler(xp_ancestor, attr: str):
+    def handle(text, rec: StandardRec) -> bool:
+        owner = _label_owner(text, xp_ancestor)
+        if owner is None:
+            return False
+        tbl = _first(_XP_NEXT_TABLE(owner))
+        setattr(rec, attr, _stripped_text(tbl, " ") if tbl is not None else None)
+        return True
+    return handle
+
+
+def _handle_sdo_table(text, rec: StandardRec) -> bool:
+    owner = _label_owner(text, _XP_ANCESTOR_SPAN)
+    if owner is None:
+        return False
+    tbl = _first(_XP_NEXT_TABLE(owner))
+    tr = tbl.find('.//tr') if tbl is not None else None
+    tds = tr.findall('.//td') if tr is not None else []
+    if len(tds) >= 3:
+        link = tds[2].find('.//a')
+        rec.sdo_acronym = tds[0].text_content().strip()
+        rec.sdo_name = tds[1].text_content().strip()
+        rec.sdo_website = link.get('href') if link is not None else None
+    return True
+
+
+LABEL_HANDLERS = {
+    "FR Recognition Number": _handle_sibling_td,
+    "Standard": _next_table_handler(_XP_ANCESTOR_TD, 'standard'),
+    "Scope/Abstract": _next_table_handler(_XP_ANCESTOR_SPAN, 'scope_abstract'),
+    "Extent of Recognition": _next_table_handler(_XP_ANCESTOR_SPAN, 'extent_of_recognition'),
+    "Standards Development Organization": _handle_sdo_table,
+}
+
 # ---------------------- PDF CLASS ----------------------
 class StandardsPDF(FPDF):
     def __init__(self):
@@ -29,18 +160,69 @@ class StandardsPDF(FPDF):
         self.set_font("Arial", 'I', 8)
         self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
 
+
+def _render_pdf(rec: StandardRec) -> bytes:
+    """Render a standard to PDF bytes; module-level so it can run in a ProcessPoolExecutor."""
+    pdf = StandardsPDF()
+    pdf.add_page()
+
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, "Standard Information", 0, 1)
+
+    for label, value in rec.main_fields():
+        pdf.set_font("Arial", 'B', 10)
+        pdf.cell(50, 6, f"{label}:", 0, 0)
+        pdf.set_font("Arial", '', 9)
+        pdf.multi_cell(0, 6, _sanitize_text(value))
+
+    pdf.set_font("Arial", 'B', 10)
+    pdf.cell(0, 8, "Standards Development Organization", 0, 1)
+    for label, value in rec.sdo_fields():
+        pdf.set_font("Arial", '', 9)
+        pdf.cell(50, 6, f"{label}:", 0, 0)
+        pdf.multi_cell(0, 6, _sanitize_text(value))
+
+    out = pdf.output(dest='S')
+    # fpdf2 returns a bytearray, PyFPDF 1.x a latin-1 str
+    return out.encode('latin-1') if isinstance(out, str) else bytes(out)
+
 # ---------------------- MAIN PROCESSOR ----------------------
 class FDAStandardsProcessor:
-    def __init__(self, pdf_path: str, html_path: str, use_s3: bool = False):
+    def __init__(self, pdf_path: str, html_path: str, use_s3: bool = False, max_workers: int = None):
         self.pdf_path = pdf_path
         self.html_path = html_path
+        # Workers spend nearly all their time waiting on FDA/S3/DB round-trips,
+        # so size for I/O concurrency rather than CPU count.
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
         self.use_s3 = use_s3 and validate_s3_config()
         self.s3_ops = S3Operations() if self.use_s3 else None
+        # S3 path updates are queued by workers and flushed once per batch.
+        self.db_ops = FDADatabaseOperations() if self.use_s3 else None
+        self._pending_updates: list[tuple] = []
+        self._pending_lock = threading.Lock()
+        # FPDF is pure Python; rendering in the I/O threads would serialize on the GIL.
+        # Started on the first render_pdf, see _get_pdf_pool.
+        self._pdf_pool = None
+        self._pdf_pool_lock = threading.Lock()
         self.session = requests.Session()
         self.session.headers.update(HEADERS)
-        os.makedirs(self.pdf_path, exist_ok=True)
-        os.makedirs(self.html_path, exist_ok=True)
-        logger.info(f"Processor initialized: PDF={self.pdf_path}, HTML={self.html_path}, S3={self.use_s3}")
+        # Detail pages are plain HTML and compress well.
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        # One keep-alive pool large enough for every worker, so connections are
+        # reused instead of being discarded once more than 10 are in flight.
+        # Transient FDA errors are retried here rather than failing the standard.
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=self.max_workers,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # In S3 mode artifacts are rendered in memory and never touch local disk.
+        if not self.use_s3:
+            os.makedirs(self.pdf_path, exist_ok=True)
+            os.makedirs(self.html_path, exist_ok=True)
+        logger.info("Processor initialized: PDF=%s, HTML=%s, S3=%s, workers=%s", self.pdf_path, self.html_path, self.use_s3, self.max_workers)
 
     # --------------------------------------------------------------------- #
     # Helper – turn any date‑like object into a printable string
@@ -54,245 +236,267 @@ class FDAStandardsProcessor:
         return str(value).strip() or "N/A"
 
     def sanitize_text(self, text):
-        if text is None:
-            return "N/A"
-        text = unicodedata.normalize("NFKD", str(text))
-        return text.encode("latin-1", "replace").decode("latin-1")
+        return _sanitize_text(text)
 
     def sanitize_filename(self, filename):
-        filename = re.sub(r'[<>:"/\\|?*]', '_', filename)
-        filename = filename.replace('\n', '_').replace('\r', '_').strip()
-        return filename
+        return _FILENAME_RE.sub('_', filename).strip()
 
     # --------------------------------------------------------------------- #
     # Extraction – unchanged except final date normalisation
     # --------------------------------------------------------------------- #
-    def extract_detailed_data(self, url: str, row: pd.Series) -> dict:
-        """Extract detailed data from a standard page, with fallback to DataFrame."""
+    def extract_detailed_data(self, url: str, date_of_entry=None) -> StandardRec:
+        """Extract detailed data from a standard page, with fallback to the DB date_of_entry."""
         try:
-            logger.debug(f"Row columns: {row.index.tolist()}")
-
-            data = {
-                "FR_Recognition_Number": None,
-                "Date_of_Entry": row.get('date_of_entry', None),   # <-- may be Timestamp
-                "Standard": None,
-                "Scope_Abstract": None,
-                "Extent_of_Recognition": None,
-                "Standards_Development_Organization": {"Acronym": None, "Name": None, "Website": None}
-            }
-            logger.info(f"Initial Date_of_Entry from DataFrame: {data['Date_of_Entry']}")
-
-            response = self.session.get(url, timeout=15)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
+            rec = StandardRec()
+            date_value = date_of_entry   # <-- may be Timestamp
+            logger.debug("Initial Date_of_Entry from DataFrame: %s", date_value)
+
+            # Parse straight off the socket (gunzipped by urllib3) rather than
+            # buffering the whole body in response.content first. One parser per
+            # call: lxml serializes concurrent use of a shared parser.
+            with self.session.get(url, timeout=15, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                # Honour a Content-Type charset; without one, libxml2 falls back to
+                # <meta charset> (get_encoding_from_headers would force ISO-8859-1).
+                charset = None
+                if "charset" in response.headers.get("Content-Type", "").lower():
+                    charset = get_encoding_from_headers(response.headers)
+                doc = lh.parse(response.raw, lh.HTMLParser(encoding=charset)).getroot()
+
+            # ---------- Single walk over text nodes ----------
+            pending = dict(LABEL_HANDLERS)
+            date_hits = {}   # DATE_LABELS index -> first text node containing it
+            for t in _XP_TEXT(doc):
+                handler = pending.get(t)
+                if handler is not None and handler(t, rec):
+                    del pending[t]
+                for m in _DATE_LABELS_RE.finditer(t):
+                    date_hits.setdefault(m.lastindex - 1, t)
+                if not pending and len(date_hits) == len(DATE_LABELS):
+                    break
 
             # ---------- Date of Entry ----------
-            date_labels = ["Date of Entry", "Publication Date", "Posted Date", "Effective Date"]
             date_found = False
-            for label in date_labels:
-                elem = soup.find(string=re.compile(label, re.IGNORECASE))
-                if elem:
-                    td = elem.find_parent("td")
-                    if td:
-                        sibling = td.find_next_sibling("td")
-                        if sibling and sibling.text.strip():
-                            data["Date_of_Entry"] = sibling.text.strip()
-                            date_found = True
-                            logger.info(f"Extracted Date_of_Entry from page: {data['Date_of_Entry']}")
-                            break
-                    parent_text = elem.find_parent().get_text(strip=True) if elem.find_parent() else ""
-                    m = re.search(r'\b(\d{1,2}[-/]\d{1,2}[-/]\d{4})\b', parent_text)
-                    if m:
-                        data["Date_of_Entry"] = m.group(1)
+            for idx in sorted(date_hits):
+                elem = date_hits[idx]
+                parent = _text_parent(elem)
+                td = _first(_XP_ANCESTOR_TD(parent)) if parent is not None else None
+                if td is not None:
+                    sibling = _first(_XP_NEXT_TD(td))
+                    if sibling is not None and sibling.text_content().strip():
+                        date_value = sibling.text_content().strip()
                         date_found = True
-                        logger.info(f"Extracted Date_of_Entry from nearby text: {data['Date_of_Entry']}")
+                        logger.debug("Extracted Date_of_Entry from page: %s", date_value)
                         break
-
-            if not date_found and data["Date_of_Entry"] is None:
-                logger.warning(f"No valid Date_of_Entry found on page, using DataFrame value: {row.get('date_of_entry', 'N/A')}")
+                parent_text = _stripped_text(parent) if parent is not None else ""
+                m = _DATE_RE.search(parent_text)
+                if m:
+                    date_value = m.group(1)
+                    date_found = True
+                    logger.debug("Extracted Date_of_Entry from nearby text: %s", date_value)
+                    break
+
+            if not date_found and date_value in (None, "N/A"):
+                logger.warning("No valid Date_of_Entry found on page, using DataFrame value: N/A")
             elif date_found:
-                logger.info(f"Overriding with page Date_of_Entry: {data['Date_of_Entry']}")
+                logger.debug("Overriding with page Date_of_Entry: %s", date_value)
             else:
-                logger.info(f"Retaining DataFrame Date_of_Entry: {data['Date_of_Entry']}")
-
-            # ---------- Other fields ----------
-            for field, label in [("FR_Recognition_Number", "FR Recognition Number")]:
-                elem = soup.find(string=label)
-                if elem:
-                    td = elem.find_parent("td").find_next_sibling("td")
-                    data[field] = td.text.strip() if td else None
-
-            std_elem = soup.find("td", string="Standard")
-            if std_elem:
-                tbl = std_elem.find_next("table")
-                data["Standard"] = tbl.get_text(" ", strip=True) if tbl else None
-
-            for field, label in [("Scope_Abstract", "Scope/Abstract"),
-                                 ("Extent_of_Recognition", "Extent of Recognition")]:
-                elem = soup.find("span", string=label)
-                if elem:
-                    tbl = elem.find_next("table")
-                    data[field] = tbl.get_text(" ", strip=True) if tbl else None
-
-            sdo_elem = soup.find("span", string="Standards Development Organization")
-            if sdo_elem:
-                tr = sdo_elem.find_next("table").find("tr")
-                tds = tr.find_all("td") if tr else []
-                if len(tds) >= 3:
-                    data["Standards_Development_Organization"] = {
-                        "Acronym": tds[0].text.strip(),
-                        "Name": tds[1].text.strip(),
-                        "Website": tds[2].find("a")["href"] if tds[2].find("a") else None
-                    }
+                logger.debug("Retaining DataFrame Date_of_Entry: %s", date_value)
 
             # ---------- FINAL DATE NORMALISATION ----------
-            data["Date_of_Entry"] = self._format_date(data["Date_of_Entry"])
+            # Dispatched rows arrive pre-formatted; only page-scraped values need it.
+            if date_found or not isinstance(date_value, str):
+                date_value = self._format_date(date_value)
+            rec.date_of_entry = date_value
 
-            return data
+            return rec
 
         except Exception as e:
-            logger.error(f"Error extracting data from {url}: {str(e)}")
+            logger.error("Error extracting data from %s: %s", url, e)
             # Fallback – still normalise the date
-            fallback = {
-                "FR_Recognition_Number": None,
-                "Date_of_Entry": row.get('date_of_entry', None),
-                "Standard": None,
-                "Scope_Abstract": None,
-                "Extent_of_Recognition": None,
-                "Standards_Development_Organization": {"Acronym": None, "Name": None, "Website": None}
-            }
-            fallback["Date_of_Entry"] = self._format_date(fallback["Date_of_Entry"])
-            logger.info(f"Exception fallback Date_of_Entry: {fallback['Date_of_Entry']}")
+            fallback = StandardRec(date_of_entry=self._format_date(date_of_entry))
+            logger.debug("Exception fallback Date_of_Entry: %s", fallback.date_of_entry)
             return fallback
 
     # --------------------------------------------------------------------- #
-    # PDF / HTML generation – unchanged (they now receive a clean string)
+    # PDF / HTML generation – render in memory, optionally write to disk
     # --------------------------------------------------------------------- #
-    def generate_pdf(self, data: dict, filename: str) -> str:
+    def _get_pdf_pool(self) -> ProcessPoolExecutor:
+        """The render process pool, started on first use.
+
+        spawn, because forking a process that already runs worker threads is
+        unsafe. Spawned workers re-import the caller's __main__ module, so a
+        script that renders PDFs must keep its top-level work under an
+        ``if __name__ == "__main__":`` guard.
+        """
+        with self._pdf_pool_lock:
+            if self._pdf_pool is None:
+                self._pdf_pool = ProcessPoolExecutor(
+                    max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pdf_pool
+
+    def render_pdf(self, rec: StandardRec) -> bytes:
+        """Render in the process pool so FPDF layout runs on all cores, off this GIL."""
+        return self._get_pdf_pool().submit(_render_pdf, rec).result()
+
+    def render_html(self, rec: StandardRec) -> str:
+        sanitize = self.sanitize_text
+        parts = ["<html><head><title>FDA Standard</title></head><body>",
+                 "<h1>FDA Standard Information</h1>"]
+        append = parts.append
+
+        for label, value in rec.main_fields():
+            append(f"<p><b>{label}:</b> {sanitize(value)}</p>")
+
+        append("<h2>Standards Development Organization</h2><ul>")
+        for label, value in rec.sdo_fields():
+            append(f"<li><b>{label}:</b> {sanitize(value)}</li>")
+        append("</ul>")
+
+        append("</body></html>")
+        return "".join(parts)
+
+    def generate_pdf(self, data: StandardRec, filename: str) -> str:
         try:
             filename = self.sanitize_filename(filename)
             local_path = os.path.join(self.pdf_path, filename)
-            pdf = StandardsPDF()
-            pdf.add_page()
-
-            pdf.set_font("Arial", 'B', 12)
-            pdf.cell(0, 10, "Standard Information", 0, 1)
-
-            for key, value in data.items():
-                if key == "Standards_Development_Organization":
-                    pdf.set_font("Arial", 'B', 10)
-                    pdf.cell(0, 8, "Standards Development Organization", 0, 1)
-                    for subkey, subvalue in value.items():
-                        pdf.set_font("Arial", '', 9)
-                        pdf.cell(50, 6, f"{self.sanitize_text(subkey)}:", 0, 0)
-                        pdf.multi_cell(0, 6, self.sanitize_text(subvalue))
-                else:
-                    pdf.set_font("Arial", 'B', 10)
-                    pdf.cell(50, 6, f"{self.sanitize_text(key)}:", 0, 0)
-                    pdf.set_font("Arial", '', 9)
-                    pdf.multi_cell(0, 6, self.sanitize_text(value))
-
-            pdf.output(local_path)
-            logger.info(f"Generated PDF: {local_path}")
+            with open(local_path, 'wb') as f:
+                f.write(self.render_pdf(data))
+            logger.debug("Generated PDF: %s", local_path)
             return local_path
 
         except Exception as e:
-            logger.error(f"Error generating PDF {filename}: {str(e)}")
+            logger.error("Error generating PDF %s: %s", filename, e)
             return None
 
-    def generate_html(self, data: dict, filename: str) -> str:
+    def generate_html(self, data: StandardRec, filename: str) -> str:
         try:
             filename = self.sanitize_filename(filename)
             local_path = os.path.join(self.html_path, filename)
-            html_content = "<html><head><title>FDA Standard</title></head><body>"
-            html_content += "<h1>FDA Standard Information</h1>"
-
-            for key, value in data.items():
-                if key == "Standards_Development_Organization":
-                    html_content += "<h2>Standards Development Organization</h2><ul>"
-                    for subkey, subvalue in value.items():
-                        html_content += f"<li><b>{self.sanitize_text(subkey)}:</b> {self.sanitize_text(subvalue)}</li>"
-                    html_content += "</ul>"
-                else:
-                    html_content += f"<p><b>{self.sanitize_text(key)}:</b> {self.sanitize_text(value)}</p>"
-
-            html_content += "</body></html>"
-
             with open(local_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            logger.info(f"Generated HTML: {local_path}")
+                f.write(self.render_html(data))
+            logger.debug("Generated HTML: %s", local_path)
             return local_path
 
         except Exception as e:
-            logger.error(f"Error generating HTML {filename}: {str(e)}")
+            logger.error("Error generating HTML %s: %s", filename, e)
             return None
 
     # --------------------------------------------------------------------- #
     # The rest of the class (process_standard, threading, cleanup) is untouched
     # --------------------------------------------------------------------- #
-    def process_standard(self, row):
+    def process_standard(self, row, existing_keys: set = None):
         try:
-            url = row['title_link']
-            pdf_filename = self.sanitize_filename(row['pdf_filename'])
-            html_filename = self.sanitize_filename(row['html_filename'])
+            url = row.title_link
+            pdf_filename = row.pdf_filename
+            html_filename = row.html_filename
 
             if self.use_s3:
-                pdf_s3_key = f"{self.s3_ops.prefix}PDF/{pdf_filename}"
-                html_s3_key = f"{self.s3_ops.prefix}HTML/{html_filename}"
-                if self.s3_ops.file_exists(pdf_s3_key) and self.s3_ops.file_exists(html_s3_key):
-                    logger.info(f"Skipping {url}: PDF and HTML already exist in S3")
-                    FDADatabaseOperations().update_s3_paths(url, pdf_filename, html_filename)
+                pdf_s3_key = row.pdf_s3_key
+                html_s3_key = row.html_s3_key
+                if existing_keys is not None:
+                    already_uploaded = pdf_s3_key in existing_keys and html_s3_key in existing_keys
+                else:
+                    already_uploaded = self.s3_ops.file_exists(pdf_s3_key) and self.s3_ops.file_exists(html_s3_key)
+                if already_uploaded:
+                    logger.debug("Skipping %s: PDF and HTML already exist in S3", url)
+                    self._queue_update(url, pdf_filename, html_filename)
                     return True
 
-            data = self.extract_detailed_data(url, row)
-            if not data:
-                logger.warning(f"No data extracted for {url}")
-                return False
-
-            pdf_path = self.generate_pdf(data, pdf_filename)
-            html_path = self.generate_html(data, html_filename)
+            data = self.extract_detailed_data(url, row.date_of_entry)
 
             if self.use_s3:
-                pdf_s3_key = f"{self.s3_ops.prefix}PDF/{pdf_filename}"
-                html_s3_key = f"{self.s3_ops.prefix}HTML/{html_filename}"
-
-                if self.s3_ops.upload_file(pdf_path, pdf_s3_key, 'application/pdf'):
-                    if self.s3_ops.upload_file(html_path, html_s3_key, 'text/html'):
-                        FDADatabaseOperations().update_s3_paths(url, pdf_filename, html_filename)
-                        os.remove(pdf_path)
-                        os.remove(html_path)
+                if self.s3_ops.upload_bytes(self.render_pdf(data), pdf_s3_key, 'application/pdf'):
+                    if self.s3_ops.upload_bytes(self.render_html(data).encode('utf-8'), html_s3_key, 'text/html'):
+                        self._queue_update(url, pdf_filename, html_filename)
                         return True
                     else:
-                        logger.error(f"Failed to upload HTML for {url}")
+                        logger.error("Failed to upload HTML for %s", url)
                         return False
                 else:
-                    logger.error(f"Failed to upload PDF for {url}")
+                    logger.error("Failed to upload PDF for %s", url)
                     return False
+
+            self.generate_pdf(data, pdf_filename)
+            self.generate_html(data, html_filename)
             return True
 
         except Exception as e:
-            logger.error(f"Error processing {row.get('recognition_number', 'unknown')}: {str(e)}")
+            logger.error("Error processing %s: %s", getattr(row, 'recognition_number', 'unknown'), e)
             return False
 
+    def _queue_update(self, url: str, pdf_filename: str, html_filename: str):
+        with self._pending_lock:
+            self._pending_updates.append((url, pdf_filename, html_filename))
+
+    def _flush_updates(self):
+        """Write all queued S3 paths to the database in one executemany."""
+        with self._pending_lock:
+            pending, self._pending_updates = self._pending_updates, []
+        if pending and not self.db_ops.update_s3_paths_bulk(pending):
+            logger.error("Failed to record S3 paths for %s standards", len(pending))
+
+    def _list_existing_s3_keys(self):
+        """Snapshot the PDF/HTML keys already in S3, or None if listing fails."""
+        try:
+            keys = set(self.s3_ops.list_keys('PDF/'))
+            keys.update(self.s3_ops.list_keys('HTML/'))
+            logger.info("Found %s existing objects under s3://%s/%s", len(keys), self.s3_ops.bucket, self.s3_ops.prefix)
+            return keys
+        except Exception as e:
+            logger.error("Error listing S3 keys, falling back to per-file checks: %s", e)
+            return None
+
+    def _prepare_dispatch(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Sanitize filenames, format dates and build S3 keys for the whole frame in one vectorized pass."""
+        pdf_filename = df['pdf_filename'].str.replace(_FILENAME_RE, '_', regex=True).str.strip()
+        html_filename = df['html_filename'].str.replace(_FILENAME_RE, '_', regex=True).str.strip()
+        columns = {'pdf_filename': pdf_filename, 'html_filename': html_filename}
+        if 'date_of_entry' in df.columns:
+            columns['date_of_entry'] = (
+                pd.to_datetime(df['date_of_entry'], errors='coerce')
+                .dt.strftime('%Y-%m-%d').fillna('N/A')
+            )
+        if self.use_s3:
+            columns['pdf_s3_key'] = f"{self.s3_ops.prefix}PDF/" + pdf_filename
+            columns['html_s3_key'] = f"{self.s3_ops.prefix}HTML/" + html_filename
+        return df.assign(**columns).reindex(columns=DISPATCH_COLUMNS)
+
     def process_unprocessed_standards(self, df: pd.DataFrame):
         if df.empty:
             logger.info("No unprocessed standards")
             return
 
+        existing_keys = self._list_existing_s3_keys() if self.use_s3 else None
+
         successful = 0
-        max_workers = min(8, max(2, os.cpu_count() or 4))
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_row = {executor.submit(self.process_standard, row): row for _, row in df.iterrows()}
-            for future in as_completed(future_to_row):
-                if future.result():
-                    successful += 1
-                time.sleep(0.1)
-
-        logger.info(f"Processed {successful}/{len(df)} standards")
-
-    def __del__(self):
-        if hasattr(self, 'session') and self.session:
-            self.session.close()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                rows = self._prepare_dispatch(df).itertuples(index=False, name='Row')
+                future_to_row = {executor.submit(self.process_standard, row, existing_keys): row for row in rows}
+                for future in as_completed(future_to_row):
+                    if future.result():
+                        successful += 1
+        finally:
+            # Record whatever was uploaded, even if the batch was interrupted.
+            if self.use_s3:
+                self._flush_updates()
+
+        logger.info("Processed %s/%s standards", successful, len(df))
+
+    def close(self):
+        """Release pooled HTTP connections and render processes; the shared DB engine and S3 client stay cached."""
+        self.session.close()
+        if self._pdf_pool is not None:
+            self._pdf_pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 
@@ -1,15 +1,43 @@
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import logging
 import os
+import threading
+from typing import Iterator
 from config import AWS_S3_BUCKET
 
 logger = logging.getLogger(__name__)
 
+# One client shared by every S3Operations instance and thread (boto3 clients
+# are thread-safe); the pool is sized above the processor's worker count.
+_CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    retries={'max_attempts': 5, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+)
+# PDFs/HTML are a few KB: single PUT, no per-upload transfer threads.
+_TRANSFER_CONFIG = TransferConfig(use_threads=False, multipart_threshold=8 * 1024 * 1024)
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def _get_s3_client():
+    """Create the shared S3 client on first use."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.client('s3', config=_CLIENT_CONFIG)
+    return _s3_client
+
+
 class S3Operations:
     def __init__(self):
-        self.s3_client = boto3.client('s3')
+        self.s3_client = _get_s3_client()
         self.bucket = AWS_S3_BUCKET
         self.prefix = 'FDA_STANDARDS/'
 
@@ -20,12 +48,28 @@ class S3Operations:
                 local_path,
                 self.bucket,
                 s3_key,
-                ExtraArgs={'ContentType': content_type}
+                ExtraArgs={'ContentType': content_type},
+                Config=_TRANSFER_CONFIG
             )
-            logger.info(f"Uploaded {local_path} to s3://{self.bucket}/{s3_key}")
+            logger.debug("Uploaded %s to s3://%s/%s", local_path, self.bucket, s3_key)
             return True
         except ClientError as e:
-            logger.error(f"Failed to upload {local_path} to S3: {str(e)}")
+            logger.error("Failed to upload %s to S3: %s", local_path, e)
+            return False
+
+    def upload_bytes(self, data: bytes, s3_key: str, content_type: str) -> bool:
+        """Upload an in-memory object to S3 with a single PutObject."""
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=s3_key,
+                Body=data,
+                ContentType=content_type
+            )
+            logger.debug("Uploaded %s bytes to s3://%s/%s", len(data), self.bucket, s3_key)
+            return True
+        except ClientError as e:
+            logger.error("Failed to upload %s to S3: %s", s3_key, e)
             return False
 
     def file_exists(self, s3_key: str) -> bool:
@@ -36,5 +80,12 @@ class S3Operations:
         except ClientError as e:
             if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
                 return False
-            logger.error(f"Error checking S3 file {s3_key}: {str(e)}")
-            return False
\ No newline at end of file
+            logger.error("Error checking S3 file %s: %s", s3_key, e)
+            return False
+
+    def list_keys(self, subprefix: str = '') -> Iterator[str]:
+        """Yield every key under prefix + subprefix, 1000 per ListObjectsV2 page."""
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}{subprefix}"):
+            for obj in page.get('Contents', []):
+                yield obj['Key']
\ No newline at end of file
@@ -1,15 +1,164 @@
 import pandas as pd
-from bs4 import BeautifulSoup
+from lxml import etree
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from requests.utils import get_encoding_from_headers
 from urllib.parse import urljoin
 import logging
+import threading
 import time
+from contextlib import nullcontext
+from email.utils import parsedate_to_datetime
+from io import BytesIO
+from sys import intern
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from config import FDA_BASE_URL, HEADERS, COLUMNS
 
 logger = logging.getLogger(__name__)
 
-def fetch_page(start: int = 1, session: requests.Session = None) -> str:
-    """Fetch a page of FDA standards results."""
+# Optional on-disk HTTP cache: re-runs replay unchanged listing pages and
+# revalidate expired ones with ETag/Last-Modified instead of re-downloading.
+try:
+    import requests_cache
+except ImportError:
+    requests_cache = None
+
+# Optional Parquet sink: lets scrape_fda_standards spill rows page by page.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+PAGE_SIZE = 500
+# Field order of the row tuples built by extract_table_rows_stream.
+ROW_FIELDS = (
+    "date_of_entry",
+    "specialty_task_group_area",
+    "recognition_number",
+    "extent_of_recognition",
+    "standards_developing_organization",
+    "standard_designation_number_and_date",
+    "standard_title",
+    "title_link",
+)
+
+# Low-cardinality fields: interned while scraping, stored as category dtype.
+CATEGORY_COLUMNS = (
+    "specialty_task_group_area",
+    "extent_of_recognition",
+    "standards_developing_organization",
+)
+
+# Result pages requested concurrently; pages past the end come back empty.
+PAGE_WINDOW = 8
+
+# Request rate (per second) and burst allowed by the shared TokenBucket.
+REQUEST_RATE = 5.0
+REQUEST_BURST = 5
+# Times a page is retried after a 429 before giving up.
+RATE_LIMIT_RETRIES = 3
+
+# XPaths for _rows_from, compiled once.
+_TDS = etree.XPath('.//td')
+_LINK = etree.XPath('(.//a)[1]')
+
+
+def _cell_text(el) -> str:
+    """Equivalent of BeautifulSoup's get_text(strip=True)."""
+    return ''.join(s.strip() for s in el.itertext())
+
+
+# Resolved once so result links can be built by concatenation.
+_BASE_DIR = urljoin(FDA_BASE_URL, ".")
+_ORIGIN = urljoin(FDA_BASE_URL, "/")[:-1]
+
+
+def _absolute_url(href: str) -> str:
+    """urljoin(FDA_BASE_URL, href), with a concat fast path for plain absolute/relative paths."""
+    # urljoin strips leading whitespace/control chars, drops tabs/newlines and
+    # resolves "." / ".." segments; leave those to it.
+    if (not href or href[0] <= " " or href[0] in ".?#" or "/." in href
+            or "\t" in href or "\n" in href or "\r" in href):
+        return urljoin(FDA_BASE_URL, href)
+    if href.startswith(("http://", "https://")):
+        return href
+    # Other schemes, network paths and empty segments (which urljoin collapses).
+    if ":" in href or "//" in href:
+        return urljoin(FDA_BASE_URL, href)
+    return (_ORIGIN if href[0] == "/" else _BASE_DIR) + href
+
+
+def _link(td):
+    """(title, absolute href) of the cell's first link, or None if it has none."""
+    links = _LINK(td)
+    if not links:
+        return None
+    a_tag = links[0]
+    href = a_tag.get("href")
+    return _cell_text(a_tag), _absolute_url(href) if href is not None else ""
+
+class TokenBucket:
+    """Thread-safe token bucket shared by the page fetchers.
+
+    The rate is halved on each 429 and grows back by 10% of the starting rate
+    on every successful request.
+    """
+
+    def __init__(self, rate: float = REQUEST_RATE, capacity: int = REQUEST_BURST, min_rate: float = 0.5):
+        self.max_rate = self.rate = rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, tokens: int = 1):
+        """Block until `tokens` are available, then take them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def backoff(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def recover(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+def _retry_after(resp, default: float = 1.0) -> float:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+
+def fetch_page(start: int = 1, session: requests.Session = None, bucket: TokenBucket = None):
+    """Fetch a page of FDA standards results as (raw bytes, charset), throttled by `bucket` if given.
+
+    Returning .content skips requests' charset detection; the parser decodes.
+    charset is the one declared in Content-Type, or None to let libxml2 use
+    the document's <meta charset>.
+    """
     if session is None:
         session = requests.Session()
         session.headers.update(HEADERS)
@@ -17,98 +166,196 @@ def fetch_page(start: int = 1, session: requests.Session = None) -> str:
     params = {
         "standardsearch": "1",
         "start_search": str(start),
-        "pagenum": 500
+        "pagenum": PAGE_SIZE
     }
-    resp = session.get(FDA_BASE_URL, headers=HEADERS, params=params, timeout=30)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        if bucket is not None:
+            bucket.consume()
+        resp = session.get(FDA_BASE_URL, headers=HEADERS, params=params, timeout=30)
+        if resp.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+            break
+        delay = _retry_after(resp)
+        resp.close()
+        if bucket is not None:
+            bucket.backoff()
+        logger.warning("Rate limited on page starting at %s, retrying in %.1fs", start, delay)
+        time.sleep(delay)
     resp.raise_for_status()
-    return resp.text
-
-def extract_table_rows(soup: BeautifulSoup, header_template=None):
-    """Extract table rows from FDA standards results page with carry logic."""
-    table = soup.find("table", {"id": "stds-results-table"})
-    if not table:
-        return [], header_template
-      
+    if bucket is not None:
+        bucket.recover()
+    # get_encoding_from_headers falls back to ISO-8859-1 for text/* without a
+    # charset, which would override the page's own declaration.
+    if "charset" in resp.headers.get("Content-Type", "").lower():
+        return resp.content, get_encoding_from_headers(resp.headers)
+    return resp.content, None
+
+def _iter_result_rows(html_bytes: bytes, encoding: str = None):
+    """Yield the results table's non-header <tr>s as they finish parsing.
+
+    Each top-level row (with any previous siblings) is freed once the consumer
+    moves on, so only the row being read is held in memory. Parsing stops at
+    the end of the results table.
+    """
+    depth = 0  # table nesting level inside the results table
+    events = etree.iterparse(BytesIO(html_bytes), events=("start", "end"), html=True, encoding=encoding)
+    for event, el in events:
+        if el.tag == "table":
+            if event == "start" and (depth or el.get("id") == "stds-results-table"):
+                depth += 1
+            elif event == "end" and depth:
+                depth -= 1
+                if not depth:
+                    return
+        elif event == "end" and depth == 1 and el.tag == "tr":
+            # Nested-table rows follow their outer row, in document order. Rows with
+            # <th> cells or inside <thead> are headers and never reach _rows_from.
+            for tr in (el, *el.iterdescendants("tr")):
+                if tr.find("th") is None and next(tr.iterancestors("thead"), None) is None:
+                    yield tr
+            el.clear(keep_tail=True)
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+
+
+def _rows_from(trs, header_template=None):
+    """Row tuples from result <tr>s, with header skipping and continuation-row carry."""
     rows = []
-    carry = [None, None, None, None]  # to handle 3-column continuation rows
+    carry = ["", "", "", ""]  # to handle 3-column continuation rows
     
-    for tr in table.find_all("tr"):
-        tds = tr.find_all("td")
-        if not tds:
+    for tr in trs:
+        tds = _TDS(tr)
+        n = len(tds)
+        if not n:
             continue
+        if header_template is not None and n < 7 and n != 3:
+            continue  # neither a data nor a continuation row
 
-        row_texts = [td.get_text(strip=True) for td in tds]
+        row_texts = [_cell_text(td) for td in tds]
 
-        # Skip header rows
+        # Skip header rows laid out in <td> cells
         if header_template is None and any("Date" in txt for txt in row_texts):
             header_template = row_texts
             continue
-        if header_template and row_texts == header_template:
+        if header_template and n == len(header_template) and row_texts == header_template:
             continue
 
-        if len(tds) >= 7:
-            a_tag = tds[6].find("a")
-            row = {
-                "date_of_entry": row_texts[0],
-                "specialty_task_group_area": row_texts[1],
-                "recognition_number": row_texts[2],
-                "extent_of_recognition": row_texts[3],
-                "standards_developing_organization": row_texts[4],
-                "standard_designation_number_and_date": row_texts[5],
-                "standard_title": a_tag.get_text(strip=True) if a_tag else row_texts[6],
-                "title_link": urljoin(FDA_BASE_URL, a_tag["href"]) if a_tag else ""
-            }
-            rows.append(row)
-            carry = row_texts[:4]
-
-        elif len(tds) == 3:  # continuation row
-            a_tag = tds[2].find("a")
-            row = {
-                "date_of_entry": carry[0],
-                "specialty_task_group_area": carry[1],
-                "recognition_number": carry[2],
-                "extent_of_recognition": carry[3],
-                "standards_developing_organization": row_texts[0],
-                "standard_designation_number_and_date": row_texts[1],
-                "standard_title": a_tag.get_text(strip=True) if a_tag else row_texts[2],
-                "title_link": urljoin(FDA_BASE_URL, a_tag["href"]) if a_tag else ""
-            }
-            rows.append(row)
+        if n >= 7:
+            title, href = _link(tds[6]) or (row_texts[6], "")
+            carry = [row_texts[0], intern(row_texts[1]), row_texts[2], intern(row_texts[3])]
+            rows.append((*carry, intern(row_texts[4]), row_texts[5], title, href))
+
+        elif n == 3:  # continuation row
+            title, href = _link(tds[2]) or (row_texts[2], "")
+            rows.append((*carry, intern(row_texts[0]), row_texts[1], title, href))
 
     return rows, header_template
 
-def scrape_fda_standards() -> pd.DataFrame:
-    """Scrape FDA standards metadata to DataFrame with pagination and carry logic."""
+def extract_table_rows_stream(html_bytes: bytes, header_template=None, encoding: str = None):
+    """Extract table rows with carry logic, stream-parsing raw page bytes with bounded memory."""
+    return _rows_from(_iter_result_rows(html_bytes, encoding), header_template)
+
+def _row_batch(rows, schema):
+    """Row tuples (ROW_FIELDS order) as a pyarrow RecordBatch."""
+    return pa.RecordBatch.from_arrays([pa.array(col, pa.string()) for col in zip(*rows)], schema=schema)
+
+def scrape_fda_standards(parquet_path: str = None) -> pd.DataFrame:
+    """Scrape FDA standards metadata to DataFrame with pagination and carry logic.
+
+    With `parquet_path` (and pyarrow installed), each page is written to that
+    Parquet file as it is parsed instead of being held in memory, and the
+    DataFrame is read back from it at the end.
+    """
     logger.info("Scraping FDA standards")
     all_rows = []
+    if parquet_path and pq is None:
+        logger.warning("pyarrow not installed, keeping scraped rows in memory instead of %s", parquet_path)
+        parquet_path = None
+    schema = pa.schema([(c, pa.string()) for c in ROW_FIELDS]) if parquet_path else None
     start = 1
-    header_template = None
-    session = requests.Session()
+    if requests_cache is not None:
+        session = requests_cache.CachedSession(
+            'fda_cache', backend='sqlite', expire_after=timedelta(hours=6),
+            cache_control=True, allowable_codes=[200]
+        )
+    else:
+        session = requests.Session()
     session.headers.update(HEADERS)
+    # Listing pages are large HTML and compress well.
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    # Keep-alive pool for the whole window; transient errors back off and retry.
+    # 429s are left to fetch_page so the token bucket can slow down.
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=PAGE_WINDOW,
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    bucket = TokenBucket()
 
-    while True:
-        logger.info(f"Scraping page starting at record {start}...")
-        try:
-            html = fetch_page(start, session)
-            soup = BeautifulSoup(html, "html.parser")
-            page_rows, header_template = extract_table_rows(soup, header_template)
+    # Pages are fetched PAGE_WINDOW at a time but parsed in-process, strictly
+    # in order, so header detection and the stop-at-short-page rule behave as
+    # before. Parsing a page takes tens of milliseconds; the fetch threads
+    # already overlap the downloads.
+    done = False
+    header_template = None
+    # Rows of the previous page. Past the end the server may repeat the last
+    # page, so a page with nothing new against it ends the scrape even if full.
+    prev = set()
+    sink = pq.ParquetWriter(parquet_path, schema, compression="zstd") if parquet_path else nullcontext()
+    with sink as writer, ThreadPoolExecutor(max_workers=PAGE_WINDOW) as executor:
+        while not done:
+            starts = [start + i * PAGE_SIZE for i in range(PAGE_WINDOW)]
+            logger.info("Scraping pages starting at records %s-%s...", starts[0], starts[-1])
+            fetches = [executor.submit(fetch_page, s, session, bucket) for s in starts]
 
-            if not page_rows:
-                logger.info("No more rows found, stopping")
-                break
+            for page_start, fetch in zip(starts, fetches):
+                try:
+                    html, charset = fetch.result()
+                    # Pages past the end have no results table; don't parse them.
+                    if b"stds-results-table" in html:
+                        # The bytes go to lxml undecoded, in the charset the server declared.
+                        page_rows, header_template = extract_table_rows_stream(html, header_template, charset)
+                    else:
+                        page_rows = []
+                except Exception as e:
+                    logger.error("Error scraping page starting at %s: %s", page_start, e)
+                    done = True
+                    break
 
-            all_rows.extend(page_rows)
+                if not page_rows:
+                    logger.info("No more rows found, stopping")
+                    done = True
+                    break
 
-            if len(page_rows) < 500:
-                break  # last page
-            start += 500
-            time.sleep(1)  # Reduced sleep time for faster scraping
+                page_set = set(page_rows)
+                if page_set <= prev:
+                    logger.info("Page starting at %s repeats the previous page, stopping", page_start)
+                    done = True
+                    break
+                prev = page_set
 
-        except Exception as e:
-            logger.error(f"Error scraping page starting at {start}: {str(e)}")
-            break
+                if writer is not None:
+                    writer.write_batch(_row_batch(page_rows, schema))
+                else:
+                    all_rows.extend(page_rows)
+
+                if len(page_rows) < PAGE_SIZE:
+                    done = True  # last page
+                    break
+
+            for future in fetches:
+                future.cancel()
+            start += PAGE_WINDOW * PAGE_SIZE
 
     session.close()
-    df = pd.DataFrame(all_rows, columns=COLUMNS).fillna("").astype(str)
-    logger.info(f"Scraped {len(df)} total standards")
+    # Every field is already a str (carry starts as ""), so no fillna/astype pass.
+    if parquet_path:
+        df = pq.read_table(parquet_path).to_pandas()
+    else:
+        df = pd.DataFrame.from_records(all_rows, columns=ROW_FIELDS)
+    if list(COLUMNS) != list(ROW_FIELDS):
+        df = df.reindex(columns=COLUMNS, fill_value="")
+    df = df.astype({col: "category" for col in CATEGORY_COLUMNS if col in df.columns})
+    logger.info("Scraped %d total standards", len(df))
     return df
\ No newline at end of file
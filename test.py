@@ -5,7 +5,7 @@ from pdf_html_generator import FDAStandardsProcessor
 df = scrape_fda_standards()
 print(df['date_of_entry'].head())   # → 2024-12-31  etc.
 
-processor = FDAStandardsProcessor(pdf_path="pdfs", html_path="htmls")
 sample = df.iloc[0]
-data = processor.extract_detailed_data(sample['title_link'], sample)
-print(data["Date_of_Entry"])        # → 2024-12-31
\ No newline at end of file
+with FDAStandardsProcessor(pdf_path="pdfs", html_path="htmls") as processor:
+    data = processor.extract_detailed_data(sample['title_link'], sample['date_of_entry'])
+print(data.date_of_entry)        # → 2024-12-31
\ No newline at end of file